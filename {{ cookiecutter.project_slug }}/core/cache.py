@@ -0,0 +1,412 @@
+"""
+Two-tier cache backend: a per-process LRU in front of a shared Django cache.
+
+Gunicorn workers don't share memory (see `web.sh`), so every read of a hot key
+either hits the network or each worker keeps its own copy. `TwoTierCache`
+keeps a bounded, size-aware LRU in each process and writes through to any
+configured Django cache (database, Redis, Memcached, ...).
+
+Every write stores a new random version next to the key in the shared tier.
+Local entries remember the version they were filled with and are trusted
+without any network round-trip for `MAX_STALENESS` seconds; after that, the
+next read compares the version (a tiny value, no payload) and either keeps or
+drops the entry. Local entries never outlive the key's timeout in the shared
+tier, so a worker never serves an entry that is more than `MAX_STALENESS`
+seconds behind the shared tier.
+
+Integers are stored as they are and skip the local tier, so `incr` and `decr`
+stay as atomic as the shared tier makes them, e.g. for counters and rate limits.
+
+Example configuration:
+
+    CACHES = {
+        "default": {
+            "BACKEND": "core.cache.TwoTierCache",
+            "OPTIONS": {
+                "SHARED_ALIAS": "shared",
+                "MAX_BYTES": 16 * 1024 * 1024,
+                "LOCAL_TIMEOUT": 60,
+                "MAX_STALENESS": 2,
+            },
+        },
+        "shared": env.cache("CACHE_URL"),
+    }
+"""
+
+import math
+import pickle
+import random
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from threading import Lock
+from typing import Any
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+VERSION_KEY_PREFIX = "two-tier-version:"
+
+
+@dataclass
+class TierStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "hit_rate": self.hit_rate}
+
+
+@dataclass
+class LocalTierStats(TierStats):
+    expirations: int = 0
+    invalidations: int = 0
+    revalidations: int = 0
+
+
+@dataclass
+class _Payload:
+    """Non-integer value as stored in the shared tier, other values are ignored."""
+
+    version: int
+    expires_at: float | None  # Wall clock, shared between processes.
+    value: Any
+
+
+@dataclass(slots=True)
+class _Entry:
+    value: bytes
+    version: int
+    expires_at: float
+    checked_at: float
+
+    @property
+    def size(self) -> int:
+        return len(self.value)
+
+
+@dataclass
+class _LocalTier:
+    entries: OrderedDict = field(default_factory=OrderedDict)
+    size: int = 0
+    lock: Lock = field(default_factory=Lock)
+    stats: LocalTierStats = field(default_factory=LocalTierStats)
+    shared_stats: TierStats = field(default_factory=TierStats)
+
+
+# Django creates one cache instance per thread, the local tier is per process.
+_local_tiers: dict[str, _LocalTier] = {}
+
+
+def _new_version() -> int:
+    return random.getrandbits(63)
+
+
+class TwoTierCache(BaseCache):
+    """
+    Cache backend with a per-process LRU in front of a shared cache alias.
+
+    OPTIONS:
+    - SHARED_ALIAS: alias in CACHES of the shared tier (default "shared")
+    - MAX_BYTES: pickled size budget of the local tier (default 16 MiB)
+    - MAX_ENTRIES: entry budget of the local tier (default 300)
+    - MAX_ENTRY_BYTES: larger values skip the local tier (default MAX_BYTES / 16)
+    - LOCAL_TIMEOUT: seconds an entry may live in the local tier (default 60)
+    - MAX_STALENESS: seconds an entry is served without checking its version
+      in the shared tier (default 1, 0 checks on every read)
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared_alias = options.get("SHARED_ALIAS", "shared")
+        self._max_bytes = int(options.get("MAX_BYTES", 16 * 1024 * 1024))
+        self._max_entry_bytes = int(
+            options.get("MAX_ENTRY_BYTES", self._max_bytes // 16)
+        )
+        self._local_timeout = float(options.get("LOCAL_TIMEOUT", 60))
+        self._max_staleness = float(options.get("MAX_STALENESS", 1))
+        self._tier = _local_tiers.setdefault(name, _LocalTier())
+
+    @property
+    def _shared(self) -> BaseCache:
+        return caches[self._shared_alias]
+
+    def _version_key(self, key):
+        return f"{VERSION_KEY_PREFIX}{key}"
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _local_expiry(self, now, expires_at):
+        """Return the monotonic local expiry for a wall clock `expires_at`."""
+        local_expiry = now + self._local_timeout
+        if expires_at is not None:
+            local_expiry = min(local_expiry, now + expires_at - time.time())
+        return local_expiry
+
+    def _write(self, key, value, timeout, version, add=False):
+        timeout = self._timeout(timeout)
+        local_key = self.make_and_validate_key(key, version=version)
+        version_key = self._version_key(key)
+        if type(value) is int:
+            return self._write_counter(key, local_key, value, timeout, version, add)
+        expires_at = None if timeout is None else time.time() + timeout
+        payload = _Payload(_new_version(), expires_at, value)
+        if add:
+            if not self._shared.add(key, payload, timeout=timeout, version=version):
+                return False
+        else:
+            self._shared.set(key, payload, timeout=timeout, version=version)
+        self._shared.set(version_key, payload.version, timeout=timeout, version=version)
+
+        # A concurrent writer may have replaced the payload before we published
+        # our version. Whoever publishes last re-reads the payload afterwards,
+        # so on a mismatch a fresh version makes every local copy invalid.
+        current = self._shared.get(key, version=version)
+        consistent = isinstance(current, _Payload) and current.version == (
+            payload.version
+        )
+        if not consistent:
+            self._shared.set(
+                version_key, _new_version(), timeout=timeout, version=version
+            )
+        now = time.monotonic()
+        with self._tier.lock:
+            self._local_delete(local_key)
+            if consistent:
+                self._local_store(
+                    local_key,
+                    value,
+                    payload.version,
+                    self._local_expiry(now, expires_at),
+                    now,
+                )
+        return True
+
+    def _write_counter(self, key, local_key, value, timeout, version, add):
+        """Store a plain integer, so `incr` can use the shared tier's `incr`."""
+        if add:
+            if not self._shared.add(key, value, timeout=timeout, version=version):
+                return False
+        else:
+            self._shared.set(key, value, timeout=timeout, version=version)
+        # Integers aren't kept locally, copies of an earlier value get invalid.
+        self._shared.delete(self._version_key(key), version=version)
+        with self._tier.lock:
+            self._local_delete(local_key)
+        return True
+
+    # Local tier helpers, call with self._tier.lock held.
+
+    def _local_lookup(self, local_key, now):
+        """Return the live entry for `local_key` or None."""
+        tier = self._tier
+        entry = tier.entries.get(local_key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._local_delete(local_key)
+            tier.stats.expirations += 1
+            return None
+        return entry
+
+    def _local_store(self, local_key, value, version, expires_at, now):
+        self._local_delete(local_key)
+        if expires_at <= now:
+            return
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        if len(pickled) > self._max_entry_bytes:
+            return
+        tier = self._tier
+        entry = _Entry(pickled, version, expires_at, now)
+        tier.entries[local_key] = entry
+        tier.size += entry.size
+        while tier.size > self._max_bytes or len(tier.entries) > self._max_entries:
+            _, evicted = tier.entries.popitem(last=False)
+            tier.size -= evicted.size
+            tier.stats.evictions += 1
+
+    def _local_delete(self, local_key):
+        entry = self._tier.entries.pop(local_key, None)
+        if entry is not None:
+            self._tier.size -= entry.size
+        return entry is not None
+
+    def _local_hit(self, local_key, entry):
+        self._tier.entries.move_to_end(local_key)
+        self._tier.stats.hits += 1
+        return pickle.loads(entry.value)
+
+    # Cache API
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._write(key, value, timeout, version, add=True)
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        local_keys = {key: self.make_and_validate_key(key, version) for key in keys}
+        tier = self._tier
+        now = time.monotonic()
+        found = {}
+        stale = {}
+        missing = []
+        with tier.lock:
+            for key in keys:
+                local_key = local_keys[key]
+                entry = self._local_lookup(local_key, now)
+                if entry is None:
+                    missing.append(key)
+                elif now - entry.checked_at < self._max_staleness:
+                    found[key] = self._local_hit(local_key, entry)
+                else:
+                    stale[key] = entry.version
+
+        if stale:
+            # One round-trip for all versions, no payloads.
+            current = self._shared.get_many(
+                [self._version_key(key) for key in stale], version=version
+            )
+            with tier.lock:
+                for key, known_version in stale.items():
+                    local_key = local_keys[key]
+                    entry = self._local_lookup(local_key, now)
+                    shared_version = current.get(self._version_key(key))
+                    tier.stats.revalidations += 1
+                    if entry is not None and shared_version == known_version:
+                        entry.checked_at = now
+                        found[key] = self._local_hit(local_key, entry)
+                        continue
+                    if shared_version is None:
+                        tier.shared_stats.evictions += 1
+                    if self._local_delete(local_key):
+                        tier.stats.invalidations += 1
+                    missing.append(key)
+
+        if missing:
+            fetched = self._shared.get_many(missing, version=version)
+            with tier.lock:
+                tier.stats.misses += len(missing)
+                for key in missing:
+                    payload = fetched.get(key)
+                    if type(payload) is int:
+                        tier.shared_stats.hits += 1
+                        found[key] = payload
+                        continue
+                    if not isinstance(payload, _Payload):
+                        tier.shared_stats.misses += 1
+                        continue
+                    tier.shared_stats.hits += 1
+                    found[key] = payload.value
+                    self._local_store(
+                        local_keys[key],
+                        payload.value,
+                        payload.version,
+                        self._local_expiry(now, payload.expires_at),
+                        now,
+                    )
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write(key, value, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Rewrite the payload of `key` with the new timeout, keeping its version.
+
+        This reads and writes back the value, a write racing with it can be lost.
+        """
+        timeout = self._timeout(timeout)
+        local_key = self.make_and_validate_key(key, version=version)
+        payload = self._shared.get(key, version=version)
+        if not isinstance(payload, _Payload):
+            with self._tier.lock:
+                self._local_delete(local_key)
+            return self._shared.touch(key, timeout=timeout, version=version)
+        payload.expires_at = None if timeout is None else time.time() + timeout
+        self._shared.set(key, payload, timeout=timeout, version=version)
+        self._shared.set(
+            self._version_key(key), payload.version, timeout=timeout, version=version
+        )
+        now = time.monotonic()
+        with self._tier.lock:
+            entry = self._local_lookup(local_key, now)
+            if entry is not None and entry.version == payload.version:
+                entry.expires_at = self._local_expiry(now, payload.expires_at)
+        return True
+
+    def delete(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        deleted = self._shared.delete(key, version=version)
+        # Without a version, local copies elsewhere fail their next revalidation.
+        self._shared.delete(self._version_key(key), version=version)
+        with self._tier.lock:
+            self._local_delete(local_key)
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        """
+        Add `delta` to the value of `key`, keeping its remaining timeout.
+
+        Integers use the shared tier's `incr`. Other numbers are read and
+        written back, so concurrent increments of them can be lost.
+        """
+        self.make_and_validate_key(key, version=version)
+        payload = self._shared.get(key, version=version)
+        if not isinstance(payload, _Payload):
+            # Integers and missing keys, which raise ValueError.
+            return self._shared.incr(key, delta, version=version)
+        timeout = None
+        if payload.expires_at is not None:
+            timeout = math.ceil(payload.expires_at - time.time())
+            if timeout <= 0:
+                raise ValueError(f"Key '{key}' not found.")
+        value = payload.value + delta
+        self._write(key, value, timeout, version)
+        return value
+
+    def has_key(self, key, version=None):
+        return key in self.get_many([key], version=version)
+
+    def clear(self):
+        """
+        Clear the shared tier and this process's local tier.
+
+        Other processes drop their local entries on their next revalidation,
+        because the versions are gone from the shared tier.
+        """
+        self._shared.clear()
+        with self._tier.lock:
+            self._tier.entries.clear()
+            self._tier.size = 0
+
+    def close(self, **kwargs):
+        self._shared.close(**kwargs)
+
+    def stats(self) -> dict:
+        """
+        Return hit rate and eviction statistics of both tiers for this process.
+
+        Shared tier evictions count versions that vanished from the shared tier
+        while a local entry still referenced them.
+        """
+        with self._tier.lock:
+            return {
+                "local": {
+                    **self._tier.stats.as_dict(),
+                    "entries": len(self._tier.entries),
+                    "bytes": self._tier.size,
+                },
+                "shared": self._tier.shared_stats.as_dict(),
+            }
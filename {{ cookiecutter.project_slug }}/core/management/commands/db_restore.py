@@ -0,0 +1,46 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.snapshots import SnapshotError, restore
+
+
+class Command(BaseCommand):
+    help = (
+        "Replace the data of the database with a snapshot of db_snapshot, loading "
+        "tables in parallel and recreating indexes and constraints at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", type=Path)
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            "--jobs", "-j", type=int, default=4, help="Number of connections."
+        )
+        parser.add_argument(
+            "--table",
+            action="append",
+            dest="tables",
+            help="Restore only this table, can be repeated.",
+        )
+
+    def handle(self, *args, **options):
+        if options["jobs"] < 1:
+            raise CommandError("--jobs must be at least 1.")
+        started = time.monotonic()
+        try:
+            restore(
+                options["database"],
+                options["directory"],
+                jobs=options["jobs"],
+                tables=options["tables"],
+                on_table=lambda result: self.stdout.write(str(result)),
+            )
+        except SnapshotError as e:
+            # Notes list the indexes and constraints that couldn't be recreated.
+            raise CommandError("\n".join([str(e), *getattr(e, "__notes__", [])])) from e
+        self.stdout.write(
+            self.style.SUCCESS(f"Restored in {time.monotonic() - started:.1f}s")
+        )
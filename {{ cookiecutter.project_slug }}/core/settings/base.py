@@ -89,6 +89,30 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Set CACHE_URL to put a per-worker LRU in front of a shared cache, see
+# core/cache.py. For a database cache, size it in the URL and create the table:
+# `CACHE_URL=dbcache://django_cache?MAX_ENTRIES=10000` and `createcachetable`.
+# Integers bypass the per-worker LRU, so `cache.incr` stays atomic where the
+# shared cache's is (Redis, Memcached). Other values use a non-atomic
+# read-modify-write in `incr`.
+
+if env.str("CACHE_URL", default=""):  # type: ignore
+    CACHES = {
+        "default": {
+            "BACKEND": "core.cache.TwoTierCache",
+            "OPTIONS": {
+                "SHARED_ALIAS": "shared",
+                "MAX_BYTES": 16 * 1024 * 1024,
+                "LOCAL_TIMEOUT": 60,
+                "MAX_STALENESS": 1,
+            },
+        },
+        "shared": env.cache("CACHE_URL"),
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
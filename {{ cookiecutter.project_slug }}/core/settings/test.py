@@ -19,3 +19,13 @@ STORAGES = {
         "BACKEND": "django.core.files.storage.FileSystemStorage",
     },
 }
+
+# Two-tier cache with the shared tier in memory
+CACHES = {
+    "default": {
+        "BACKEND": "core.cache.TwoTierCache",
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
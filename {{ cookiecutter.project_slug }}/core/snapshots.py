@@ -0,0 +1,479 @@
+"""
+Parallel per-table PostgreSQL snapshots, used by `db_snapshot` and `db_restore`.
+
+A snapshot is a directory with a `manifest.json` and one gzip compressed binary
+`COPY` stream per table. All tables are dumped from the same exported
+transaction snapshot, so the archive is consistent even though every table uses
+its own connection. A table whose checksum didn't change since the previous
+snapshot in the same directory keeps its existing archive. Archive names
+contain the checksum and the manifest is replaced last, so a failed run leaves
+the previous snapshot intact.
+
+Restores load into an existing schema (run `migrate` first). Indexes, primary
+keys, unique and foreign key constraints are dropped before loading and
+recreated in parallel at the end. The statements to recreate them are written
+to `restore-ddl.sql` in the snapshot directory first and kept if any fails.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.db import connections
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT = 1
+RESTORE_DDL_FILE = "restore-ddl.sql"
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class SnapshotError(Exception):
+    pass
+
+
+@dataclass
+class TableResult:
+    table: str
+    rows: int
+    bytes: int
+    seconds: float
+    skipped: bool = False
+
+    def __str__(self) -> str:
+        if self.skipped:
+            return f"{self.table}: unchanged, {self.rows} rows"
+        megabytes = self.bytes / 1024 / 1024
+        rate = megabytes / self.seconds if self.seconds else 0.0
+        return (
+            f"{self.table}: {self.rows} rows, {megabytes:.1f} MB "
+            f"in {self.seconds:.1f}s ({rate:.1f} MB/s)"
+        )
+
+
+class _CountingFile:
+    """File wrapper counting the bytes passing through `read` and `write`."""
+
+    def __init__(self, file):
+        self.file = file
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.bytes += len(data)
+        return data
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.file.write(data)
+
+
+def _connect(alias):
+    """Open a new raw connection, independent of Django's per-thread one."""
+    wrapper = connections[alias]
+    if wrapper.vendor != "postgresql":
+        raise SnapshotError(
+            f"Database {alias!r} uses {wrapper.vendor}, snapshots need PostgreSQL."
+        )
+    return wrapper.get_new_connection(wrapper.get_connection_params())
+
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _copy_to(cursor, sql, file):
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+    if is_psycopg3:
+        with cursor.copy(sql) as copy:
+            for data in copy:
+                file.write(data)
+    else:
+        cursor.copy_expert(sql, file, size=COPY_CHUNK_SIZE)
+
+
+def _copy_from(cursor, sql, file):
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+    if is_psycopg3:
+        with cursor.copy(sql) as copy:
+            while data := file.read(COPY_CHUNK_SIZE):
+                copy.write(data)
+    else:
+        cursor.copy_expert(sql, file, size=COPY_CHUNK_SIZE)
+
+
+def _run_parallel(jobs, func, items, on_result=None):
+    """Call `func` for every item on `jobs` threads, stop at the first error."""
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if on_result is not None:
+                    on_result(result)
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def _run_all(jobs, func, items):
+    """Call `func` for every item on `jobs` threads, return `(item, error)`s."""
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(func, item): item for item in items}
+    return [
+        (item, future.exception())
+        for future, item in futures.items()
+        if future.exception() is not None
+    ]
+
+
+def _execute(alias, sql):
+    connection = _connect(alias)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _list_tables(cursor):
+    cursor.execute(
+        """
+        SELECT c.relname
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r'
+            AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+            AND pg_table_is_visible(c.oid)
+        ORDER BY c.relname
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _table_columns(cursor, table):
+    """Return `[name, type]` of the columns `COPY` can read and write."""
+    cursor.execute(
+        """
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass
+            AND attnum > 0
+            AND NOT attisdropped
+            AND attgenerated = ''
+        ORDER BY attnum
+        """,
+        [_quote(table)],
+    )
+    return [list(row) for row in cursor.fetchall()]
+
+
+def _table_checksum(cursor, table):
+    """Return an order independent checksum of all rows and the row count."""
+    cursor.execute(
+        f"SELECT count(*), coalesce(sum(hashtextextended(t::text, 0)), 0) "
+        f"FROM {_quote(table)} AS t"
+    )
+    rows, checksum = cursor.fetchone()
+    return f"{rows}:{checksum}", rows
+
+
+def read_manifest(directory: Path) -> dict:
+    path = directory / MANIFEST_FILE
+    try:
+        manifest = json.loads(path.read_text())
+    except FileNotFoundError as e:
+        raise SnapshotError(f"No snapshot found in {directory}.") from e
+    if manifest.get("format") != MANIFEST_FORMAT:
+        raise SnapshotError(f"Unsupported snapshot format in {path}.")
+    return manifest
+
+
+def snapshot(
+    alias: str,
+    directory: Path,
+    jobs: int = 4,
+    compress_level: int = 1,
+    full: bool = False,
+    on_table: Callable[[TableResult], None] | None = None,
+) -> dict:
+    """
+    Dump every table of `alias` into `directory` and return the manifest.
+
+    Unchanged tables of a previous snapshot in `directory` are kept, unless
+    `full` is set.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    try:
+        previous = {} if full else read_manifest(directory)["tables"]
+    except SnapshotError:
+        previous = {}
+    tables = {}
+
+    def dump(table):
+        started = time.monotonic()
+        connection = _connect(alias)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"
+                )
+                cursor.execute("SET TRANSACTION SNAPSHOT %s", [snapshot_id])
+                columns = _table_columns(cursor, table)
+                checksum, rows = _table_checksum(cursor, table)
+                digest = hashlib.sha1(
+                    json.dumps([checksum, columns]).encode()
+                ).hexdigest()[:12]
+                entry = {
+                    "file": f"{table}.{digest}.copy.gz",
+                    "checksum": checksum,
+                    "rows": rows,
+                    "columns": columns,
+                }
+                path = directory / entry["file"]
+                if previous.get(table) == entry and path.exists():
+                    tables[table] = entry
+                    return TableResult(
+                        table, rows, 0, time.monotonic() - started, skipped=True
+                    )
+
+                column_names = ", ".join(_quote(name) for name, _ in columns)
+                partial = path.with_name(f"{path.name}.partial")
+                with gzip.open(partial, "wb", compresslevel=compress_level) as file:
+                    stream = _CountingFile(file)
+                    _copy_to(
+                        cursor,
+                        f"COPY {_quote(table)} ({column_names}) "
+                        f"TO STDOUT (FORMAT binary)",
+                        stream,
+                    )
+                os.replace(partial, path)
+        finally:
+            connection.close()
+        tables[table] = entry
+        return TableResult(table, rows, stream.bytes, time.monotonic() - started)
+
+    # The leader keeps the exported snapshot alive until every table is dumped.
+    leader = _connect(alias)
+    try:
+        with leader.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            cursor.execute("SELECT pg_export_snapshot()")
+            snapshot_id = cursor.fetchone()[0]
+            names = _list_tables(cursor)
+        _run_parallel(jobs, dump, names, on_table)
+    finally:
+        leader.close()
+
+    manifest = {"format": MANIFEST_FORMAT, "tables": dict(sorted(tables.items()))}
+    partial = directory / f"{MANIFEST_FILE}.partial"
+    partial.write_text(json.dumps(manifest, indent=2))
+    os.replace(partial, directory / MANIFEST_FILE)
+    files = {entry["file"] for entry in tables.values()}
+    for path in directory.glob("*.copy.gz*"):
+        if path.name not in files:
+            path.unlink()
+    return manifest
+
+
+def _deferred_ddl(cursor, tables):
+    """
+    Return `(drop, create, create_foreign_keys)` statements for the indexes and
+    constraints of `tables`.
+    """
+    cursor.execute(
+        """
+        SELECT t.relname, con.conname, con.contype, pg_get_constraintdef(con.oid)
+        FROM pg_constraint con
+        JOIN pg_class t ON t.oid = con.conrelid
+        WHERE con.contype IN ('p', 'u', 'f')
+            AND t.relname = ANY(%s)
+            AND pg_table_is_visible(t.oid)
+        ORDER BY con.contype = 'f' DESC
+        """,
+        [list(tables)],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE t.relname = ANY(%s)
+            AND pg_table_is_visible(t.oid)
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint con
+                WHERE con.conindid = x.indexrelid
+                    AND con.conrelid = x.indrelid
+                    AND con.contype IN ('p', 'u', 'x')
+            )
+        """,
+        [list(tables)],
+    )
+    indexes = cursor.fetchall()
+
+    drop, create, create_foreign_keys = [], [], []
+    for table, name, kind, definition in constraints:
+        drop.append(f"ALTER TABLE {_quote(table)} DROP CONSTRAINT {_quote(name)}")
+        add = f"ALTER TABLE {_quote(table)} ADD CONSTRAINT {_quote(name)} {definition}"
+        (create_foreign_keys if kind == "f" else create).append(add)
+    for name, definition in indexes:
+        drop.append(f"DROP INDEX {_quote(name)}")
+        create.append(definition)
+    return drop, create, create_foreign_keys
+
+
+def _inbound_foreign_keys(cursor, tables):
+    """Return `table.constraint` of foreign keys from other tables into `tables`."""
+    cursor.execute(
+        """
+        SELECT t.relname, con.conname
+        FROM pg_constraint con
+        JOIN pg_class t ON t.oid = con.conrelid
+        JOIN pg_class r ON r.oid = con.confrelid
+        WHERE con.contype = 'f'
+            AND r.relname = ANY(%(tables)s)
+            AND NOT t.relname = ANY(%(tables)s)
+            AND pg_table_is_visible(r.oid)
+        ORDER BY t.relname, con.conname
+        """,
+        {"tables": list(tables)},
+    )
+    return [f"{table}.{name}" for table, name in cursor.fetchall()]
+
+
+def restore(
+    alias: str,
+    directory: Path,
+    jobs: int = 4,
+    on_table: Callable[[TableResult], None] | None = None,
+    tables: Iterable[str] | None = None,
+) -> None:
+    """Replace the rows of the snapshot's tables in `alias` with the snapshot."""
+    entries = read_manifest(directory)["tables"]
+    if tables is not None:
+        unknown = set(tables) - set(entries)
+        if unknown:
+            raise SnapshotError(f"Tables not in snapshot: {', '.join(sorted(unknown))}")
+        entries = {table: entries[table] for table in tables}
+    # Nothing is dropped before every archive is known to be there.
+    unreadable = [
+        entry["file"]
+        for entry in entries.values()
+        if not (directory / entry["file"]).is_file()
+        or not os.access(directory / entry["file"], os.R_OK)
+    ]
+    if unreadable:
+        raise SnapshotError(
+            f"Missing or unreadable archives in {directory}: "
+            f"{', '.join(sorted(unreadable))}"
+        )
+
+    def load(table):
+        entry = entries[table]
+        started = time.monotonic()
+        column_names = ", ".join(_quote(name) for name, _ in entry["columns"])
+        connection = _connect(alias)
+        try:
+            with connection.cursor() as cursor:
+                # Truncating in the same transaction lets PostgreSQL skip WAL
+                # for the load when wal_level is minimal.
+                cursor.execute(f"TRUNCATE {_quote(table)}")
+                path = directory / entry["file"]
+                try:
+                    with gzip.open(path, "rb") as file:
+                        stream = _CountingFile(file)
+                        _copy_from(
+                            cursor,
+                            f"COPY {_quote(table)} ({column_names}) "
+                            f"FROM STDIN (FORMAT binary)",
+                            stream,
+                        )
+                except (OSError, EOFError) as e:
+                    raise SnapshotError(f"Can't read {path}: {e}") from e
+                rows = cursor.rowcount
+            connection.commit()
+        finally:
+            connection.close()
+        return TableResult(table, rows, stream.bytes, time.monotonic() - started)
+
+    leader = _connect(alias)
+    try:
+        with leader.cursor() as cursor:
+            existing = set(_list_tables(cursor))
+            missing = set(entries) - existing
+            if missing:
+                raise SnapshotError(
+                    f"Tables missing in database {alias!r}: "
+                    f"{', '.join(sorted(missing))}. Run migrate first."
+                )
+            for table, entry in entries.items():
+                if _table_columns(cursor, table) != entry["columns"]:
+                    raise SnapshotError(f"Columns of {table} don't match the snapshot.")
+            # Their rows would have to match the restored ones, don't touch them.
+            inbound = _inbound_foreign_keys(cursor, entries)
+            if inbound:
+                raise SnapshotError(
+                    "Foreign keys of tables outside the restore point at restored "
+                    f"tables: {', '.join(inbound)}. Restore those tables too."
+                )
+            drop, create, create_foreign_keys = _deferred_ddl(cursor, entries)
+            ddl_path = directory / RESTORE_DDL_FILE
+            try:
+                ddl_path.write_text(
+                    "".join(f"{sql};\n" for sql in create + create_foreign_keys)
+                )
+            except OSError as e:
+                raise SnapshotError(f"Can't write {ddl_path}: {e}") from e
+            for sql in drop:
+                cursor.execute(sql)
+        leader.commit()
+
+        load_error = None
+        try:
+            _run_parallel(jobs, load, list(entries), on_table)
+        except BaseException as e:
+            load_error = e
+        # Recreate everything, even after a failed load or statement. Foreign
+        # keys need the primary keys and unique constraints back first.
+        failures = _run_all(jobs, lambda sql: _execute(alias, sql), create)
+        failures += _run_all(
+            jobs, lambda sql: _execute(alias, sql), create_foreign_keys
+        )
+        if failures:
+            message = (
+                f"{len(failures)} indexes or constraints couldn't be recreated, "
+                f"all statements are in {ddl_path}:\n"
+                + "\n".join(f"{sql}: {error}" for sql, error in failures)
+            )
+            if load_error is None:
+                raise SnapshotError(message)
+            load_error.add_note(message)
+        else:
+            ddl_path.unlink()
+        if load_error is not None:
+            raise load_error
+
+        with leader.cursor() as cursor:
+            for table in entries:
+                for sequence in connections[alias].introspection.get_sequences(
+                    cursor, table
+                ):
+                    column = _quote(sequence["column"])
+                    cursor.execute(
+                        f"SELECT setval(%s, coalesce(max({column}), 1), "
+                        f"max({column}) IS NOT NULL) FROM {_quote(table)}",
+                        [sequence["name"]],
+                    )
+        leader.commit()
+    finally:
+        leader.close()
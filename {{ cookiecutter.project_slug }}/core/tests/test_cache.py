@@ -0,0 +1,210 @@
+# ABOUTME: Tests for the two-tier cache backend
+# ABOUTME: Ensures local hits, cross-worker invalidation and LRU limits
+
+import time
+
+import pytest
+from django.core.cache import caches
+
+from core.cache import TwoTierCache, _local_tiers
+
+
+@pytest.fixture
+def make_worker():
+    """Return a factory for caches that simulate separate gunicorn workers."""
+    caches["shared"].clear()
+
+    def factory(name, **options):
+        _local_tiers.pop(name, None)
+        return TwoTierCache(name, {"OPTIONS": {"SHARED_ALIAS": "shared", **options}})
+
+    return factory
+
+
+class TestTwoTierCache:
+    def test_hot_read_served_from_local_tier(self, make_worker):
+        """Test that a repeated read doesn't touch the shared tier."""
+        worker = make_worker("worker-1")
+        worker.set("key", "value")
+        caches["shared"].clear()
+
+        assert worker.get("key") == "value"
+        assert worker.stats()["local"]["hits"] == 1
+
+    def test_read_through_from_shared_tier(self, make_worker):
+        """Test that a local miss is filled from the shared tier."""
+        make_worker("worker-1").set("key", "value")
+        worker = make_worker("worker-2")
+
+        assert worker.get("key") == "value"
+        assert worker.get("key") == "value"
+        stats = worker.stats()
+        assert stats["local"] == {**stats["local"], "hits": 1, "misses": 1}
+        assert stats["shared"]["hits"] == 1
+
+    def test_write_invalidates_other_workers(self, make_worker):
+        """Test that a stale entry is dropped once its version is checked."""
+        writer = make_worker("worker-1", MAX_STALENESS=0)
+        reader = make_worker("worker-2", MAX_STALENESS=0)
+        writer.set("key", "old")
+        assert reader.get("key") == "old"
+
+        writer.set("key", "new")
+
+        assert reader.get("key") == "new"
+        assert reader.stats()["local"]["invalidations"] == 1
+
+    def test_delete_invalidates_other_workers(self, make_worker):
+        """Test that a deleted key isn't served from another worker's tier."""
+        writer = make_worker("worker-1", MAX_STALENESS=0)
+        reader = make_worker("worker-2", MAX_STALENESS=0)
+        writer.set("key", "value")
+        assert reader.get("key") == "value"
+
+        writer.delete("key")
+
+        assert reader.get("key", "default") == "default"
+
+    def test_stale_entry_served_within_bound(self, make_worker):
+        """Test that entries are trusted without a version check for a while."""
+        writer = make_worker("worker-1")
+        reader = make_worker("worker-2", MAX_STALENESS=60)
+        writer.set("key", "old")
+        assert reader.get("key") == "old"
+
+        writer.set("key", "new")
+
+        assert reader.get("key") == "old"
+
+    def test_lru_eviction_by_size(self, make_worker):
+        """Test that the least recently used entry is evicted first."""
+        worker = make_worker("worker-1", MAX_BYTES=300, MAX_ENTRY_BYTES=300)
+        worker.set("a", "x" * 100)
+        worker.set("b", "x" * 100)
+        worker.get("a")
+        worker.set("c", "x" * 100)
+
+        stats = worker.stats()["local"]
+        assert stats["evictions"] == 1
+        assert stats["bytes"] <= 300
+        caches["shared"].clear()
+        assert worker.get("a") is not None
+        assert worker.get("b") is None
+
+    def test_get_many_mixes_tiers(self, make_worker):
+        """Test that get_many combines local hits and shared reads."""
+        make_worker("worker-1").set_many({"a": 1, "b": 2})
+        worker = make_worker("worker-2")
+        worker.set("c", 3)
+
+        assert worker.get_many(["a", "b", "c", "d"]) == {"a": 1, "b": 2, "c": 3}
+
+    def test_incr_uses_shared_incr(self, make_worker, monkeypatch):
+        """Test that integers are incremented by the shared tier itself."""
+        shared = caches["shared"]
+        shared_incr = shared.incr
+        calls = []
+
+        def spy_incr(*args, **kwargs):
+            calls.append(args)
+            return shared_incr(*args, **kwargs)
+
+        monkeypatch.setattr(shared, "incr", spy_incr)
+        worker = make_worker("worker-1")
+        worker.set("counter", 1)
+
+        assert worker.incr("counter") == 2
+        assert worker.decr("counter", 2) == 0
+        assert make_worker("worker-2").get("counter") == 0
+        assert len(calls) == 2
+        assert shared.get("counter") == 0
+
+    def test_incr_other_numbers_keeps_timeout(self, make_worker):
+        """Test that incr of non-integers goes through both tiers."""
+        worker = make_worker("worker-1")
+        worker.set("amount", 1.5, timeout=100)
+        expires_at = caches["shared"].get("amount").expires_at
+
+        assert worker.incr("amount") == 2.5
+        assert make_worker("worker-2").get("amount") == 2.5
+        assert caches["shared"].get("amount").expires_at == pytest.approx(
+            expires_at, abs=1
+        )
+
+    def test_touch_past_original_timeout(self, make_worker):
+        """Test that a touched key is cached and counted past its old timeout."""
+        writer = make_worker("worker-1")
+        writer.set("key", "value", timeout=1)
+        writer.set("amount", 1.5, timeout=1)
+        assert writer.touch("key", 100)
+        assert writer.touch("amount", 100)
+
+        time.sleep(1.2)
+
+        reader = make_worker("worker-2")
+        assert reader.get("key") == "value"
+        assert reader.get("key") == "value"
+        assert reader.stats()["local"]["hits"] == 1
+        assert reader.incr("amount") == 2.5
+
+    def test_incr_missing_key(self, make_worker):
+        """Test that incr of a missing key raises like other backends."""
+        with pytest.raises(ValueError):
+            make_worker("worker-1").incr("missing")
+
+    def test_local_copy_expires_with_shared_timeout(self, make_worker):
+        """Test that a read-through entry doesn't outlive the key's timeout."""
+        make_worker("worker-1").set("key", "value", timeout=1)
+        reader = make_worker("worker-2", MAX_STALENESS=0)
+        assert reader.get("key") == "value"
+
+        time.sleep(1.1)
+
+        assert reader.get("key") is None
+
+    def test_concurrent_write_not_served_stale(self, make_worker, monkeypatch):
+        """Test that a write racing with another doesn't leave a stale copy."""
+        first = make_worker("worker-1", MAX_STALENESS=0)
+        second = make_worker("worker-2", MAX_STALENESS=0)
+        shared = caches["shared"]
+        shared_set = shared.set
+        raced = []
+
+        def racing_set(key, value, *args, **kwargs):
+            shared_set(key, value, *args, **kwargs)
+            if key == "key" and not raced:
+                # Second worker writes in between our payload and version.
+                raced.append(True)
+                second.set("key", "second")
+
+        monkeypatch.setattr(shared, "set", racing_set)
+        first.set("key", "first")
+        monkeypatch.undo()
+
+        assert first.get("key") == "second"
+        assert second.get("key") == "second"
+
+    def test_has_key_after_delete_elsewhere(self, make_worker):
+        """Test that has_key revalidates like get."""
+        writer = make_worker("worker-1", MAX_STALENESS=0)
+        reader = make_worker("worker-2", MAX_STALENESS=0)
+        writer.set("key", "value")
+        assert reader.has_key("key")
+
+        writer.delete("key")
+
+        assert not reader.has_key("key")
+
+    def test_foreign_value_is_a_miss(self, make_worker):
+        """Test that values not written by this backend are ignored."""
+        caches["shared"].set("raw", "plain")
+
+        assert make_worker("worker-1").get("raw", "default") == "default"
+
+    def test_add_keeps_existing_value(self, make_worker):
+        """Test that add doesn't overwrite an existing key."""
+        worker = make_worker("worker-1")
+
+        assert worker.add("key", "first")
+        assert not worker.add("key", "second")
+        assert worker.get("key") == "first"
@@ -0,0 +1,102 @@
+# ABOUTME: Tests for the db_snapshot and db_restore management commands
+# ABOUTME: Ensures snapshots round-trip, skip unchanged tables and need PostgreSQL
+
+import json
+from io import StringIO
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+
+requires_postgresql = pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="Snapshots need PostgreSQL"
+)
+
+
+def run(command, *args):
+    stdout = StringIO()
+    call_command(command, *args, stdout=stdout)
+    return stdout.getvalue()
+
+
+@requires_postgresql
+@pytest.mark.django_db(transaction=True)
+class TestSnapshotRestore:
+    def test_restore_replaces_data_with_snapshot(self, tmp_path):
+        """Test that a restore brings back exactly the snapshotted rows."""
+        User.objects.create_user("alice")
+        User.objects.create_user("bob")
+        run("db_snapshot", str(tmp_path), "--jobs", "2")
+
+        User.objects.filter(username="alice").delete()
+        User.objects.create_user("carol")
+        run("db_restore", str(tmp_path), "--jobs", "2")
+
+        usernames = User.objects.order_by("username").values_list("username", flat=True)
+        assert list(usernames) == ["alice", "bob"]
+        assert not (tmp_path / "restore-ddl.sql").exists()
+
+    def test_restore_resets_sequences(self, tmp_path):
+        """Test that inserts after a restore continue after the restored rows."""
+        User.objects.create_user("alice")
+        User.objects.create_user("bob")
+        restored_pks = list(User.objects.values_list("pk", flat=True))
+        run("db_snapshot", str(tmp_path))
+        with connection.cursor() as cursor:
+            cursor.execute("TRUNCATE auth_user RESTART IDENTITY CASCADE")
+
+        run("db_restore", str(tmp_path))
+
+        assert User.objects.create_user("carol").pk > max(restored_pks)
+
+    def test_restore_rejects_inbound_foreign_keys(self, tmp_path):
+        """Test that a partial restore doesn't drop foreign keys of other tables."""
+        run("db_snapshot", str(tmp_path))
+
+        with pytest.raises(CommandError, match="Restore those tables too"):
+            run("db_restore", str(tmp_path), "--table", "auth_user")
+
+    def test_snapshot_skips_unchanged_tables(self, tmp_path):
+        """Test that only tables with a new checksum are dumped again."""
+        User.objects.create_user("alice")
+        run("db_snapshot", str(tmp_path))
+
+        User.objects.create_user("bob")
+        output = run("db_snapshot", str(tmp_path))
+
+        assert "auth_user: 2 rows" in output
+        assert "auth_group: unchanged" in output
+
+
+@pytest.mark.skipif(connection.vendor == "postgresql", reason="Runs on PostgreSQL")
+def test_snapshot_requires_postgresql(tmp_path):
+    """Test that other databases are rejected with a clear error."""
+    with pytest.raises(CommandError, match="snapshots need PostgreSQL"):
+        run("db_snapshot", str(tmp_path))
+
+
+def test_restore_checks_archives_first(tmp_path):
+    """Test that a missing archive is reported before the database is touched."""
+    manifest = {
+        "format": 1,
+        "tables": {
+            "auth_user": {
+                "file": "auth_user.0123456789ab.copy.gz",
+                "checksum": "0:0",
+                "rows": 0,
+                "columns": [["id", "integer"]],
+            }
+        },
+    }
+    (tmp_path / "manifest.json").write_text(json.dumps(manifest))
+
+    with pytest.raises(CommandError, match="auth_user.0123456789ab.copy.gz"):
+        run("db_restore", str(tmp_path))
+
+
+@pytest.mark.parametrize("command", ["db_snapshot", "db_restore"])
+def test_jobs_must_be_positive(command, tmp_path):
+    """Test that --jobs below 1 is rejected before any work starts."""
+    with pytest.raises(CommandError, match="--jobs must be at least 1"):
+        run(command, str(tmp_path), "--jobs", "0")